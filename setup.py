@@ -34,6 +34,9 @@ setuptools.setup(
     packages=setuptools.find_packages(),
 
     install_requires=install_requires,
+    extras_require={
+        "animated": ["rlottie-python"],
+    },
     python_requires="~=3.6",
 
     classifiers=[
@@ -51,5 +54,6 @@ setuptools.setup(
         "sticker-import=sticker.stickerimport:cmd",
         "sticker-pack=sticker.pack:cmd",
         "sticker-download-thumbnails=sticker.download_thumbnails:cmd",
+        "sticker-serve=sticker.serve:cmd",
     ]},
 )
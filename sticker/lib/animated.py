@@ -0,0 +1,270 @@
+# maunium-stickerpicker - A fast and simple Matrix sticker picker widget.
+# Copyright (C) 2025 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+from io import BytesIO
+from pathlib import Path
+import subprocess
+import tempfile
+import argparse
+import os
+import shutil
+import json
+import math
+import zlib
+
+from PIL import Image, ImageSequence
+
+try:
+    from rlottie_python import LottieAnimation
+except ImportError:
+    LottieAnimation = None
+
+TGS_MAGIC = b"\x1f\x8b"
+WEBM_MAGIC = b"\x1a\x45\xdf\xa3"
+
+# Telegram limits TGS files to 64 KiB, the decompressed Lottie JSON is never anywhere near this
+MAX_LOTTIE_JSON_SIZE = 16 * 1024 * 1024
+MIN_FRAME_DURATION = 20
+WEBP_QUALITY_STEPS = (80, 60, 40)
+FFMPEG_TIMEOUT = 60
+
+
+class Limits(NamedTuple):
+    format: str = "webp"
+    max_frames: int = 60
+    max_size: int = 512
+    max_bytes: int = 512 * 1024
+    fps: int = 30
+    workers: Optional[int] = None
+
+
+limits = Limits()
+_pool: Optional[ProcessPoolExecutor] = None
+
+Frames = Tuple[List[Image.Image], List[int]]
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--animated-format", help="Output format for animated stickers",
+                        choices=("webp", "apng", "static"), default=limits.format)
+    parser.add_argument("--max-frames", help="Maximum number of frames in animated stickers",
+                        type=int, default=limits.max_frames, metavar="count")
+    parser.add_argument("--max-animated-size",
+                        help="Maximum width and height of animated stickers in pixels",
+                        type=int, default=limits.max_size, metavar="pixels")
+    parser.add_argument("--max-animated-bytes",
+                        help="Maximum file size of animated stickers. Larger animations are "
+                             "reduced and finally replaced with their first frame.",
+                        type=int, default=limits.max_bytes, metavar="bytes")
+    parser.add_argument("--workers", help="Number of processes used for converting animations",
+                        type=int, default=limits.workers, metavar="count")
+
+
+def load_args(args: argparse.Namespace) -> None:
+    global limits
+    limits = limits._replace(format=args.animated_format, max_frames=args.max_frames,
+                             max_size=args.max_animated_size, max_bytes=args.max_animated_bytes,
+                             workers=args.workers)
+
+
+def is_tgs(data: bytes) -> bool:
+    return data.startswith(TGS_MAGIC)
+
+
+def is_webm(data: bytes) -> bool:
+    return data.startswith(WEBM_MAGIC)
+
+
+def is_animated(data: bytes) -> bool:
+    if is_tgs(data) or is_webm(data):
+        return True
+    try:
+        image: Image.Image = Image.open(BytesIO(data))
+    except Exception:
+        return False
+    return getattr(image, "is_animated", False)
+
+
+def _decompress_tgs(data: bytes) -> str:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    json_data = decompressor.decompress(data, MAX_LOTTIE_JSON_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Lottie animation is too large")
+    return json_data.decode("utf-8")
+
+
+def _fit(w: int, h: int, max_size: int) -> Tuple[int, int]:
+    if w <= max_size and h <= max_size:
+        return w, h
+    scale = max_size / max(w, h)
+    return max(int(w * scale), 1), max(int(h * scale), 1)
+
+
+def _load_tgs(data: bytes, lim: Limits, first_only: bool = False) -> Frames:
+    if LottieAnimation is None:
+        raise RuntimeError("rlottie-python is not installed, can't convert TGS stickers")
+    anim = LottieAnimation.from_data(_decompress_tgs(data))
+    total = anim.lottie_animation_get_totalframe()
+    fps = anim.lottie_animation_get_framerate() or 60
+    w, h = _fit(*anim.lottie_animation_get_size(), lim.max_size)
+    step = 1 if first_only else max(math.ceil(total / lim.max_frames), 1)
+    frame_nums = [0] if first_only else range(0, total, step)
+    frames = [anim.render_pillow_frame(frame_num=i, width=w, height=h) for i in frame_nums]
+    return frames, [max(round(1000 * step / fps), MIN_FRAME_DURATION)] * len(frames)
+
+
+def _probe_webm(ffprobe: str, path: Path) -> Tuple[Optional[str], Optional[float]]:
+    proc = subprocess.run([
+        ffprobe, "-v", "error", "-select_streams", "v:0", "-of", "json",
+        "-show_entries", "stream=codec_name:format=duration", str(path),
+    ], check=True, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    info = json.loads(proc.stdout)
+    streams = info.get("streams") or [{}]
+    duration = info.get("format", {}).get("duration")
+    return streams[0].get("codec_name"), float(duration) if duration else None
+
+
+def _load_webm(data: bytes, lim: Limits, first_only: bool = False) -> Frames:
+    ffmpeg = shutil.which("ffmpeg")
+    ffprobe = shutil.which("ffprobe")
+    if not ffmpeg or not ffprobe:
+        raise RuntimeError("ffmpeg is not installed, can't convert WEBM stickers")
+    max_frames = 1 if first_only else lim.max_frames
+    with tempfile.TemporaryDirectory(prefix="sticker-") as tmpdir:
+        input_path = Path(tmpdir, "input.webm")
+        input_path.write_bytes(data)
+        codec, duration = _probe_webm(ffprobe, input_path)
+        fps = lim.fps
+        if duration:
+            # Spread the frame budget over the whole clip instead of cutting it short
+            fps = min(fps, max_frames / duration)
+        # The native VP8/VP9 decoders drop the alpha channel, so libvpx is preferred when available
+        decoders = [["-c:v", "libvpx-vp9" if codec == "vp9" else "libvpx"], []]
+        for decoder in decoders:
+            try:
+                subprocess.run([
+                    ffmpeg, "-v", "error", *decoder, "-i", str(input_path),
+                    "-vf", f"fps={fps:.3f},scale=w={lim.max_size}:h={lim.max_size}"
+                           f":force_original_aspect_ratio=decrease",
+                    "-frames:v", str(max_frames), str(Path(tmpdir, "frame-%04d.png")),
+                ], check=True, capture_output=True, timeout=FFMPEG_TIMEOUT)
+                break
+            except subprocess.CalledProcessError:
+                if decoder is decoders[-1]:
+                    raise
+        frames = []
+        for path in sorted(Path(tmpdir).glob("frame-*.png")):
+            with Image.open(path) as frame:
+                frames.append(frame.convert("RGBA"))
+    if not frames:
+        raise ValueError("ffmpeg didn't output any frames")
+    return frames, [max(round(1000 / fps), MIN_FRAME_DURATION)] * len(frames)
+
+
+def _load_pillow(data: bytes, lim: Limits) -> Frames:
+    image: Image.Image = Image.open(BytesIO(data))
+    n_frames = getattr(image, "n_frames", 1)
+    step = max(math.ceil(n_frames / lim.max_frames), 1)
+    frames = []
+    durations = []
+    for i, frame in enumerate(ImageSequence.Iterator(image)):
+        duration = max(frame.info.get("duration", 100), MIN_FRAME_DURATION)
+        if i % step == 0:
+            frame = frame.convert("RGBA")
+            frame.thumbnail((lim.max_size, lim.max_size), Image.LANCZOS)
+            frames.append(frame)
+            durations.append(duration)
+        else:
+            durations[-1] += duration
+    return frames, durations
+
+
+def _load_frames(data: bytes, lim: Limits) -> Frames:
+    if is_tgs(data):
+        return _load_tgs(data, lim)
+    elif is_webm(data):
+        return _load_webm(data, lim)
+    return _load_pillow(data, lim)
+
+
+def _drop_frames(frames: List[Image.Image], durations: List[int]) -> Frames:
+    new_durations = [sum(durations[i:i + 2]) for i in range(0, len(durations), 2)]
+    return frames[::2], new_durations
+
+
+def _encode(frames: List[Image.Image], durations: List[int], fmt: str, quality: int) -> bytes:
+    output = BytesIO()
+    if fmt == "apng":
+        frames[0].save(output, "png", save_all=True, append_images=frames[1:],
+                       duration=durations, loop=0, disposal=1, blend=0, optimize=True)
+    else:
+        frames[0].save(output, "webp", save_all=True, append_images=frames[1:],
+                       duration=durations, loop=0, quality=quality, method=4)
+    return output.getvalue()
+
+
+def _encode_static(frame: Image.Image) -> bytes:
+    output = BytesIO()
+    frame.save(output, "png")
+    return output.getvalue()
+
+
+def convert(data: bytes, lim: Limits) -> Optional[Tuple[bytes, str, int, int]]:
+    """
+    Convert an animated sticker (TGS, WEBM, GIF, WebP or APNG) into an animated WebP or APNG
+    within the given limits. This is CPU-heavy and is meant to be ran in a worker process.
+
+    Returns:
+        The converted image data, its mimetype and its real width and height, or ``None`` if the
+        sticker has only one frame or doesn't fit in the byte limit even after dropping frames.
+    """
+    frames, durations = _load_frames(data, lim)
+    mimetype = "image/png" if lim.format == "apng" else "image/webp"
+    while len(frames) > 1:
+        for quality in WEBP_QUALITY_STEPS:
+            output = _encode(frames, durations, lim.format, quality)
+            if len(output) <= lim.max_bytes:
+                return output, mimetype, frames[0].width, frames[0].height
+            elif lim.format == "apng":
+                break
+        frames, durations = _drop_frames(frames, durations)
+    return None
+
+
+def first_frame(data: bytes, lim: Optional[Limits] = None) -> bytes:
+    """
+    Get a static version of a sticker that Pillow can open. Formats that Pillow can read directly
+    are returned as-is, since opening an image gives the first frame anyway.
+    """
+    if is_tgs(data):
+        frames, _ = _load_tgs(data, lim or limits, first_only=True)
+    elif is_webm(data):
+        frames, _ = _load_webm(data, lim or limits, first_only=True)
+    else:
+        return data
+    return _encode_static(frames[0])
+
+
+def concurrency() -> int:
+    return limits.workers or os.cpu_count() or 1
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=concurrency())
+    return _pool
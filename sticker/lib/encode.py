@@ -0,0 +1,159 @@
+# maunium-stickerpicker - A fast and simple Matrix sticker picker widget.
+# Copyright (C) 2025 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from typing import List, NamedTuple, Optional, Tuple
+from array import array
+from io import BytesIO
+import argparse
+import sys
+
+from PIL import Image
+
+PASSTHROUGH_FORMATS = {"PNG": "image/png", "WEBP": "image/webp"}
+# Building an exact palette is done pixel by pixel, so it's skipped for huge images
+EXACT_PALETTE_MAX_PIXELS = 1024 * 1024
+DOWNSCALE_STEP = 0.75
+MIN_DOWNSCALE_SIZE = 16
+
+
+class Options(NamedTuple):
+    resample: bool = False
+    webp: bool = False
+    max_bytes: int = 256 * 1024
+    passthrough_bytes: int = 32 * 1024
+
+
+options = Options()
+
+Encoded = Tuple[bytes, str]
+ColorRGBA = Tuple[int, int, int, int]
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--resample", action="store_true",
+                        help="Resize uploaded stickers to the size advertised to clients")
+    parser.add_argument("--webp", action="store_true",
+                        help="Allow uploading static stickers as WebP if it's smaller than PNG")
+    parser.add_argument("--max-image-bytes",
+                        help="File size budget for static stickers. Lossy palette quantization "
+                             "is only used if lossless encodings don't fit, and the image is "
+                             "downscaled if even that doesn't fit.",
+                        type=int, default=options.max_bytes, metavar="bytes")
+    parser.add_argument("--passthrough-bytes",
+                        help="Upload PNG (and WebP with --webp) files smaller than this as-is",
+                        type=int, default=options.passthrough_bytes, metavar="bytes")
+
+
+def load_args(args: argparse.Namespace) -> None:
+    global options
+    options = options._replace(resample=args.resample, webp=args.webp,
+                               max_bytes=args.max_image_bytes,
+                               passthrough_bytes=args.passthrough_bytes)
+
+
+def _save(image: Image.Image, fmt: str, **kwargs) -> bytes:
+    output = BytesIO()
+    image.save(output, fmt, **kwargs)
+    return output.getvalue()
+
+
+def _png(image: Image.Image) -> Encoded:
+    return _save(image, "png", optimize=True), "image/png"
+
+
+def _palette_png(image: Image.Image) -> Encoded:
+    return _png(image.quantize(256, method=Image.FASTOCTREE))
+
+
+def _exact_palette_png(image: Image.Image, colors: List[Tuple[int, ColorRGBA]]
+                       ) -> Optional[Encoded]:
+    palette = [color for _, color in colors]
+    # Compare pixels as packed 32-bit integers, which is much faster than going through tuples
+    indices = {int.from_bytes(bytes(color), sys.byteorder): i for i, color in enumerate(palette)}
+    pixels = array("I", image.tobytes())
+    paletted = Image.frombytes("P", image.size, bytes(indices[pixel] for pixel in pixels))
+    paletted.putpalette([channel for color in palette for channel in color], rawmode="RGBA")
+    data, mimetype = _png(paletted)
+    # Make sure the palette survived encoding, otherwise this wouldn't be lossless
+    with Image.open(BytesIO(data)) as decoded:
+        if decoded.convert("RGBA").tobytes() != image.tobytes():
+            return None
+    return data, mimetype
+
+
+def _webp(image: Image.Image) -> Encoded:
+    return _save(image, "webp", lossless=True, quality=100, method=6), "image/webp"
+
+
+def _can_pass_through(source: Image.Image, size: Tuple[int, int], opts: Options) -> bool:
+    if source.format not in PASSTHROUGH_FORMATS or getattr(source, "is_animated", False):
+        return False
+    elif source.format == "WEBP" and not opts.webp:
+        return False
+    return source.size == size
+
+
+def encode(data: bytes, size: Tuple[int, int], opts: Options) -> Tuple[bytes, str, int, int]:
+    """
+    Encode a static sticker as compactly as possible, downscaling it if necessary to fit in the
+    byte budget.
+
+    Args:
+        data: The source image data.
+        size: The size that will be advertised to clients. The image is only resized to this if
+            resampling is enabled.
+        opts: The encoding options.
+
+    Returns:
+        The encoded image data, its mimetype and its real width and height.
+    """
+    source: Image.Image = Image.open(BytesIO(data))
+    image = source.convert("RGBA")
+    if opts.resample and image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+    passthrough = _can_pass_through(source, image.size, opts)
+    if passthrough and len(data) <= opts.passthrough_bytes:
+        return data, PASSTHROUGH_FORMATS[source.format], image.width, image.height
+
+    original = (data, PASSTHROUGH_FORMATS[source.format]) if passthrough else None
+    best = _encode_smallest(image, opts, original)
+    while len(best[0]) > opts.max_bytes and min(image.size) > MIN_DOWNSCALE_SIZE:
+        # Not even lossy quantization fits in the budget, so make the image smaller until it does
+        new_size = (max(int(image.width * DOWNSCALE_STEP), 1),
+                    max(int(image.height * DOWNSCALE_STEP), 1))
+        image = image.resize(new_size, Image.LANCZOS)
+        best = _encode_smallest(image, opts)
+    return (*best, image.width, image.height)
+
+
+def _encode_smallest(image: Image.Image, opts: Options, original: Optional[Encoded] = None
+                     ) -> Encoded:
+    colors = image.getcolors(256)
+    candidates = [_png(image)]
+    if colors is not None and image.width * image.height <= EXACT_PALETTE_MAX_PIXELS:
+        exact = _exact_palette_png(image, colors)
+        if exact is not None:
+            candidates.append(exact)
+    if opts.webp:
+        candidates.append(_webp(image))
+    if original:
+        candidates.append(original)
+    best = min(candidates, key=lambda candidate: len(candidate[0]))
+    if len(best[0]) > opts.max_bytes:
+        # Lossy quantization is only used as a last resort
+        quantized = _palette_png(image)
+        if len(quantized[0]) < len(best[0]):
+            best = quantized
+    return best
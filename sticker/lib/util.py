@@ -15,6 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from functools import partial
 from io import BytesIO
+import asyncio
 import os.path
 import json
 from pathlib import Path
@@ -22,15 +23,11 @@ from typing import Dict, List
 
 from PIL import Image
 
-from . import matrix
+from . import matrix, animated, encode
 
 open_utf8 = partial(open, encoding='UTF-8')
 
-def convert_image(data: bytes, max_w=256, max_h=256) -> (bytes, int, int):
-    image: Image.Image = Image.open(BytesIO(data)).convert("RGBA")
-    new_file = BytesIO()
-    image.save(new_file, "png")
-    w, h = image.size
+def shrink_size(w: int, h: int, max_w=256, max_h=256) -> (int, int):
     if w > max_w or h > max_h:
         # Set the width and height to lower values so clients wouldn't show them as huge images
         if w > h:
@@ -39,9 +36,53 @@ def convert_image(data: bytes, max_w=256, max_h=256) -> (bytes, int, int):
         else:
             w = int(w / (h / max_h))
             h = max_h
+    return w, h
+
+
+def convert_image(data: bytes, max_w=256, max_h=256) -> (bytes, int, int):
+    image: Image.Image = Image.open(BytesIO(data)).convert("RGBA")
+    new_file = BytesIO()
+    image.save(new_file, "png")
+    w, h = shrink_size(*image.size, max_w, max_h)
     return new_file.getvalue(), w, h
 
 
+def _convert_sticker(data: bytes, lim: animated.Limits, opts: encode.Options, max_w: int,
+                     max_h: int) -> (bytes, str, int, int, bytes):
+    if animated.is_animated(data):
+        still = animated.first_frame(data, lim)
+        result = animated.convert(data, lim) if lim.format != "static" else None
+        if result:
+            data, mimetype, w, h = result
+            return (data, mimetype, *shrink_size(w, h, max_w, max_h), still)
+        data = still
+    with Image.open(BytesIO(data)) as image:
+        size = shrink_size(*image.size, max_w, max_h)
+    data, mimetype, _, _ = encode.encode(data, size, opts)
+    return (data, mimetype, *size, data)
+
+
+async def convert_sticker(data: bytes, max_w=256, max_h=256) -> (bytes, str, int, int, bytes):
+    """
+    Convert a sticker for uploading in the conversion worker pool.
+
+    Returns:
+        The converted data, its mimetype, the width and height to advertise, and a static
+        version of the sticker for :func:`add_thumbnails`.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(animated.get_pool(), _convert_sticker, data,
+                                      animated.limits, encode.options, max_w, max_h)
+
+
+async def first_frame(data: bytes) -> bytes:
+    if not animated.is_tgs(data) and not animated.is_webm(data):
+        return data
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(animated.get_pool(), animated.first_frame, data,
+                                      animated.limits)
+
+
 def add_to_index(name: str, output_dir: str) -> None:
     index_path = os.path.join(output_dir, "index.json")
     try:
@@ -59,7 +100,7 @@ def add_to_index(name: str, output_dir: str) -> None:
 
 
 def make_sticker(mxc: str, width: int, height: int, size: int,
-                 body: str = "") -> matrix.StickerInfo:
+                 body: str = "", mimetype: str = "image/png") -> matrix.StickerInfo:
     return {
         "body": body,
         "url": mxc,
@@ -67,7 +108,7 @@ def make_sticker(mxc: str, width: int, height: int, size: int,
             "w": width,
             "h": height,
             "size": size,
-            "mimetype": "image/png",
+            "mimetype": mimetype,
 
             # Element iOS compatibility hack
             "thumbnail_url": mxc,
@@ -75,7 +116,7 @@ def make_sticker(mxc: str, width: int, height: int, size: int,
                 "w": width,
                 "h": height,
                 "size": size,
-                "mimetype": "image/png",
+                "mimetype": mimetype,
             },
         },
         "msgtype": "m.sticker",
@@ -86,7 +127,10 @@ def add_thumbnails(stickers: List[matrix.StickerInfo], stickers_data: Dict[str,
     thumbnails = Path(output_dir, "thumbnails")
     thumbnails.mkdir(parents=True, exist_ok=True)
 
-    for sticker in stickers:       
+    for sticker in stickers:
+        if sticker["url"] not in stickers_data:
+            continue
+        # TGS and WEBM stickers must be passed through first_frame() to get something Pillow can open
         image_data, _, _ = convert_image(stickers_data[sticker["url"]], 128, 128)
         
         name = sticker["url"].split("/")[-1]
@@ -13,8 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
-from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from hashlib import sha256
 import mimetypes
 import argparse
@@ -29,7 +28,7 @@ except ImportError:
     print("[Warning] Magic is not installed, using file extensions to guess mime types")
     magic = None
 
-from .lib import matrix, util
+from .lib import matrix, util, animated, encode
 
 
 def convert_name(name: str) -> str:
@@ -41,26 +40,27 @@ def convert_name(name: str) -> str:
 
 
 async def upload_sticker(file: str, directory: str, old_stickers: Dict[str, matrix.StickerInfo]
-                         ) -> Optional[matrix.StickerInfo]:
+                         ) -> Optional[Tuple[matrix.StickerInfo, bytes]]:
     if file.startswith("."):
         return None
     path = os.path.join(directory, file)
     if not os.path.isfile(path):
         return None
 
-    if magic:
+    if file.endswith(".tgs"):
+        mime = "application/x-tgsticker"
+    elif magic:
         mime = magic.from_file(path, mime=True)
     else:
         mime, _ = mimetypes.guess_type(file)
-    if not mime.startswith("image/"):
+    if not mime or not (mime.startswith("image/") or mime in ("video/webm", "application/x-tgsticker")):
         return None
 
-    print(f"Processing {file}", end="", flush=True)
     try:
         with open(path, "rb") as image_file:
             image_data = image_file.read()
     except Exception as e:
-        print(f"... failed to read file: {e}")
+        print(f"Failed to read {file}: {e}")
         return None
     name = os.path.splitext(file)[0]
 
@@ -70,26 +70,26 @@ async def upload_sticker(file: str, directory: str, old_stickers: Dict[str, matr
         name = name_split[1]
 
     sticker_id = f"sha256:{sha256(image_data).hexdigest()}"
-    print(".", end="", flush=True)
     if sticker_id in old_stickers:
         sticker = {
             **old_stickers[sticker_id],
             "body": name,
         }
-        print(f".. using existing upload")
+        still = await util.first_frame(image_data)
+        print(f"Using existing upload for {file}")
     else:
-        image_data, width, height = util.convert_image(image_data)
-        print(".", end="", flush=True)
-        mxc = await matrix.upload(image_data, "image/png", file)
-        print(".", end="", flush=True)
-        sticker = util.make_sticker(mxc, width, height, len(image_data), name)
+        image_data, mimetype, width, height, still = await util.convert_sticker(image_data)
+        mxc = await matrix.upload(image_data, mimetype, file)
+        sticker = util.make_sticker(mxc, width, height, len(image_data), name, mimetype)
         sticker["id"] = sticker_id
-        print(" uploaded", flush=True)
-    return sticker
+        print(f"Uploaded {file}", flush=True)
+    return sticker, still
 
 
 async def main(args: argparse.Namespace) -> None:
     await matrix.load_config(args.config)
+    animated.load_args(args)
+    encode.load_args(args)
 
     dirname = os.path.basename(os.path.abspath(args.path))
     meta_path = os.path.join(args.path, "pack.json")
@@ -108,11 +108,22 @@ async def main(args: argparse.Namespace) -> None:
         old_stickers = {sticker["id"]: sticker for sticker in pack["stickers"]}
         pack["stickers"] = []
 
+    # Convert several stickers at once so that the conversion worker pool is kept busy
+    semaphore = asyncio.Semaphore(animated.concurrency())
+
+    async def upload(file: str) -> Optional[Tuple[matrix.StickerInfo, bytes]]:
+        async with semaphore:
+            try:
+                return await upload_sticker(file, args.path, old_stickers=old_stickers)
+            except Exception as e:
+                print(f"Failed to upload {file}, skipping it: {e}", flush=True)
+                return None
+
+    results = await asyncio.gather(*(upload(file) for file in sorted(os.listdir(args.path))))
     stickers_data: Dict[str, bytes] = {}
-    for file in sorted(os.listdir(args.path)):
-        sticker = await upload_sticker(file, args.path, old_stickers=old_stickers)
-        if sticker:
-            stickers_data[sticker["url"]]  = Path(args.path, file).read_bytes()
+    for result in results:
+        if result:
+            sticker, stickers_data[result[0]["url"]] = result
             pack["stickers"].append(sticker)
 
     with util.open_utf8(meta_path, "w") as pack_file:
@@ -139,6 +150,8 @@ parser.add_argument("--title", help="Override the sticker pack displayname", typ
 parser.add_argument("--id", help="Override the sticker pack ID", type=str, metavar="id")
 parser.add_argument("--add-to-index", help="Sticker picker pack directory (usually 'web/packs/')",
                     type=str, metavar="path")
+animated.add_arguments(parser)
+encode.add_arguments(parser)
 parser.add_argument("path", help="Path to the sticker pack directory", type=str)
 
 
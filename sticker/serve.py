@@ -0,0 +1,252 @@
+# maunium-stickerpicker - A fast and simple Matrix sticker picker widget.
+# Copyright (C) 2025 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+from hashlib import sha256
+from pathlib import Path
+import mimetypes
+import argparse
+import asyncio
+import gzip
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+MIN_COMPRESS_SIZE = 1024
+# Preferred first, the precompressed file for each encoding is looked up with the suffix
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("image/svg+xml", ".svg")
+
+
+class CachedFile(NamedTuple):
+    mtime_ns: int
+    size: int
+    etag: str
+    content_type: str
+    # Encoding -> body, the identity encoding is stored under an empty string
+    bodies: Dict[str, bytes]
+
+    @property
+    def memory_size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _read_precompressed(path: Path, mtime_ns: int, suffix: str) -> Optional[bytes]:
+    compressed_path = path.with_name(path.name + suffix)
+    try:
+        if compressed_path.stat().st_mtime_ns < mtime_ns:
+            # Outdated precompressed file, ignore it
+            return None
+        return compressed_path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def load_file(path: Path) -> CachedFile:
+    stat = path.stat()
+    data = path.read_bytes()
+    content_type, file_encoding = mimetypes.guess_type(path.name)
+    if file_encoding or not content_type:
+        # Don't pretend that e.g. foo.tar.xz is a plain tar file
+        content_type = "application/octet-stream"
+    bodies = {"": data}
+    for encoding, suffix in ENCODINGS.items():
+        compressed = _read_precompressed(path, stat.st_mtime_ns, suffix)
+        if compressed is None and _is_compressible(content_type) and len(data) >= MIN_COMPRESS_SIZE:
+            if encoding == "gzip":
+                compressed = gzip.compress(data, mtime=0)
+            elif encoding == "br" and brotli:
+                compressed = brotli.compress(data)
+        if compressed is not None and len(compressed) < len(data):
+            bodies[encoding] = compressed
+    return CachedFile(mtime_ns=stat.st_mtime_ns, size=stat.st_size,
+                      etag=sha256(data).hexdigest()[:32], content_type=content_type, bodies=bodies)
+
+
+class FileCache:
+    max_size: int
+    max_file_size: int
+    size: int
+    files: 'OrderedDict[Path, CachedFile]'
+    loading: Dict[Path, 'asyncio.Future[CachedFile]']
+
+    def __init__(self, max_size: int, max_file_size: int) -> None:
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.size = 0
+        self.files = OrderedDict()
+        self.loading = {}
+
+    def _remove(self, path: Path) -> None:
+        self.size -= self.files.pop(path).memory_size
+
+    async def get(self, path: Path) -> Optional[CachedFile]:
+        """
+        Get a file from the cache, (re)loading it if it has changed on disk.
+
+        Returns:
+            The cached file, or ``None`` if the file is too large to be cached.
+        """
+        stat = path.stat()
+        cached = self.files.get(path)
+        if cached and cached.mtime_ns == stat.st_mtime_ns and cached.size == stat.st_size:
+            self.files.move_to_end(path)
+            return cached
+        elif cached:
+            self._remove(path)
+        if stat.st_size > self.max_file_size:
+            return None
+        # Concurrent misses on the same file share a single load
+        load = self.loading.get(path)
+        if load is None:
+            load = self.loading[path] = asyncio.ensure_future(self._load(path))
+        return await asyncio.shield(load)
+
+    async def _load(self, path: Path) -> CachedFile:
+        try:
+            cached = await asyncio.get_running_loop().run_in_executor(None, load_file, path)
+        finally:
+            del self.loading[path]
+        if path in self.files:
+            self._remove(path)
+        self.files[path] = cached
+        self.size += cached.memory_size
+        while self.size > self.max_size and len(self.files) > 1:
+            self._remove(next(iter(self.files)))
+        return cached
+
+
+def parse_accept_encoding(header: str) -> List[str]:
+    accepted = []
+    for item in header.split(","):
+        encoding, *params = item.strip().split(";")
+        if any(param.strip() in ("q=0", "q=0.0", "q=0.00", "q=0.000") for param in params):
+            continue
+        accepted.append(encoding.strip().lower())
+    return accepted
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    for item in header.split(","):
+        item = item.strip()
+        if item.startswith("W/"):
+            item = item[2:]
+        if item == "*" or item == etag:
+            return True
+    return False
+
+
+class StaticServer:
+    web_dir: Path
+    packs_dir: Path
+    cache: FileCache
+
+    def __init__(self, web_dir: Path, packs_dir: Path, cache: FileCache) -> None:
+        self.web_dir = web_dir.resolve()
+        self.packs_dir = packs_dir.resolve()
+        self.cache = cache
+
+    @staticmethod
+    def _resolve(root: Path, subpath: str) -> Path:
+        path = (root / subpath).resolve()
+        if path != root and root not in path.parents:
+            raise web.HTTPNotFound()
+        if path.is_dir():
+            path = path / "index.html"
+        if not path.is_file() or path.suffix in ENCODINGS.values():
+            # Precompressed files are only served through Content-Encoding
+            raise web.HTTPNotFound()
+        return path
+
+    async def serve_web(self, request: web.Request) -> web.StreamResponse:
+        path = self._resolve(self.web_dir, request.match_info["path"])
+        return await self._serve(request, path, REVALIDATE)
+
+    async def serve_pack(self, request: web.Request) -> web.StreamResponse:
+        path = self._resolve(self.packs_dir, request.match_info["path"])
+        if path.parent == self.packs_dir / "thumbnails":
+            # Thumbnails are extensionless PNGs named after the mxc URI of the sticker,
+            # so they never change
+            return await self._serve(request, path, IMMUTABLE, content_type="image/png")
+        return await self._serve(request, path, REVALIDATE)
+
+    async def _serve(self, request: web.Request, path: Path, cache_control: str,
+                     content_type: Optional[str] = None) -> web.StreamResponse:
+        cached = await self.cache.get(path)
+        if cached is None:
+            headers = {"Cache-Control": cache_control}
+            if content_type:
+                headers["Content-Type"] = content_type
+            return web.FileResponse(path, headers=headers)
+        accepted = parse_accept_encoding(request.headers.get("Accept-Encoding", ""))
+        encoding = next((enc for enc in ENCODINGS if enc in accepted and enc in cached.bodies), "")
+        etag = f'"{cached.etag}-{encoding}"' if encoding else f'"{cached.etag}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("If-None-Match", ""), etag):
+            return web.Response(status=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return web.Response(body=cached.bodies[encoding],
+                            content_type=content_type or cached.content_type, headers=headers)
+
+
+def make_app(args: argparse.Namespace) -> web.Application:
+    server = StaticServer(Path(args.web_dir), Path(args.packs_dir),
+                          FileCache(max_size=args.cache_size, max_file_size=args.max_cached_file))
+    app = web.Application()
+    app.router.add_get("/packs/{path:.*}", server.serve_pack)
+    app.router.add_get("/{path:.*}", server.serve_web)
+    return app
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", help="Host to listen on", type=str, default="127.0.0.1",
+                    metavar="host")
+parser.add_argument("--port", help="Port to listen on", type=int, default=8080, metavar="port")
+parser.add_argument("--web-dir", help="Path to the sticker picker web directory", type=str,
+                    default="web", metavar="path")
+parser.add_argument("--packs-dir", help="Sticker picker pack directory", type=str,
+                    default="web/packs", metavar="path")
+parser.add_argument("--cache-size", help="Maximum memory used for caching files",
+                    type=int, default=32 * 1024 * 1024, metavar="bytes")
+parser.add_argument("--max-cached-file", help="Files larger than this are always read from disk",
+                    type=int, default=1024 * 1024, metavar="bytes")
+
+
+def cmd():
+    args = parser.parse_args()
+    web.run_app(make_app(args), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    cmd()
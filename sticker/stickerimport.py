@@ -13,7 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 import argparse
 import asyncio
 import os.path
@@ -26,18 +26,16 @@ from telethon.tl.types.messages import AllStickers
 from telethon.tl.types import InputStickerSetShortName, Document, DocumentAttributeSticker
 from telethon.tl.types.messages import StickerSet as StickerSetFull
 
-from .lib import matrix, util
+from .lib import matrix, util, animated, encode
 
 
 async def reupload_document(client: TelegramClient, document: Document) -> Tuple[matrix.StickerInfo, bytes]:
-    print(f"Reuploading {document.id}", end="", flush=True)
+    print(f"Reuploading {document.id}", flush=True)
     data = await client.download_media(document, file=bytes)
-    print(".", end="", flush=True)
-    data, width, height = util.convert_image(data)
-    print(".", end="", flush=True)
-    mxc = await matrix.upload(data, "image/png", f"{document.id}.png")
-    print(".", flush=True)
-    return util.make_sticker(mxc, width, height, len(data)), data
+    data, mimetype, width, height, still = await util.convert_sticker(data)
+    mxc = await matrix.upload(data, mimetype, f"{document.id}.{mimetype.split('/')[-1]}")
+    print(f"Reuploaded {document.id}", flush=True)
+    return util.make_sticker(mxc, width, height, len(data), mimetype=mimetype), still
 
 
 def add_meta(document: Document, info: matrix.StickerInfo, pack: StickerSetFull) -> None:
@@ -75,23 +73,43 @@ async def reupload_pack(client: TelegramClient, pack: StickerSetFull, output_dir
     except FileNotFoundError:
         pass
 
+    # Reupload several stickers at once so that the conversion worker pool is kept busy
+    semaphore = asyncio.Semaphore(animated.concurrency())
+
+    async def reupload(document: Document) -> Optional[Tuple[matrix.StickerInfo, bytes]]:
+        async with semaphore:
+            try:
+                return await reupload_document(client, document)
+            except Exception as e:
+                print(f"Failed to reupload {document.id}, skipping it: {e}", flush=True)
+                return None
+
+    new_documents = [document for document in pack.documents
+                     if document.id not in already_uploaded]
+    results = await asyncio.gather(*(reupload(document) for document in new_documents))
+    reuploaded = {document.id: result for document, result in zip(new_documents, results)}
+
     stickers_data: Dict[str, bytes] = {}
     reuploaded_documents: Dict[int, matrix.StickerInfo] = {}
     for document in pack.documents:
-        try:
+        if reuploaded.get(document.id):
+            reuploaded_documents[document.id], data = reuploaded[document.id]
+            stickers_data[reuploaded_documents[document.id]["url"]] = data
+        elif document.id in already_uploaded:
             reuploaded_documents[document.id] = already_uploaded[document.id]
             print(f"Skipped reuploading {document.id}")
-        except KeyError:
-            reuploaded_documents[document.id], data = await reupload_document(client, document)
+        else:
+            continue
         # Always ensure the body and telegram metadata is correct
         add_meta(document, reuploaded_documents[document.id], pack)
-        stickers_data[reuploaded_documents[document.id]["url"]] = data
 
     for sticker in pack.packs:
         if not sticker.emoticon:
             continue
         for document_id in sticker.documents:
-            doc = reuploaded_documents[document_id]
+            doc = reuploaded_documents.get(document_id)
+            if not doc:
+                continue
             # If there was no sticker metadata, use the first emoji we find
             if doc["body"] == "":
                 doc["body"] = sticker.emoticon
@@ -126,11 +144,15 @@ parser.add_argument("--config",
                     type=str, default="config.json")
 parser.add_argument("--output-dir", help="Directory to write packs to", default="web/packs/",
                     type=str)
+animated.add_arguments(parser)
+encode.add_arguments(parser)
 parser.add_argument("pack", help="Sticker pack URLs to import", action="append", nargs="*")
 
 
 async def main(args: argparse.Namespace) -> None:
     await matrix.load_config(args.config)
+    animated.load_args(args)
+    encode.load_args(args)
     client = TelegramClient(args.session, 298751, "cb676d6bae20553c9996996a8f52b4d7")
     await client.start()
 